@@ -1,8 +1,23 @@
+import asyncio  # Библиотека для асинхронного выполнения (event loop)
 import openai  # Библиотека OpenAI для взаимодействия с API
-import json    # Библиотека для работы с JSON (аргументы и ответы функций)
+import aiohttp  # HTTP-клиент на базе asyncio (постоянная сессия с keep-alive)
+from openai import AsyncOpenAI, DefaultAioHttpClient  # Асинхронный клиент OpenAI и транспорт на базе aiohttp
+from openai.types.chat import ChatCompletion  # Модель ответа API (для разбора ответа на прямой запрос)
+from httpx_aiohttp import AiohttpTransport  # Транспорт httpx поверх готовой сессии aiohttp
+import orjson  # Быстрая библиотека для работы с JSON (аргументы и ответы функций)
 import os      # Библиотека для работы с операционной системой (доступ к переменным окружения)
+import sys     # Доступ к стандартному вводу (чтение накопившихся строк)
+import threading  # Фоновый поток для чтения ввода пользователя
+import select  # Проверка готовности стандартного ввода без блокировки
+import random  # Случайная составляющая паузы между повторами запросов
+import re      # Регулярные выражения (быстрая обработка простых команд без модели)
+import mmap    # Отображение файла журнала в память (быстрое восстановление склада)
+import time    # Отметки времени для записей журнала и ограничения частоты запросов
+from contextlib import asynccontextmanager  # Асинхронные контекстные менеджеры (ограничитель запросов)
+from array import array  # Компактный массив чисел (количества товаров на складе)
+from collections import OrderedDict, deque  # Упорядоченный словарь (LRU-кэш ответов) и ограниченная очередь (история)
 from dotenv import load_dotenv  # Функция для загрузки переменных окружения из .env файла
-from typing import List, Dict, Any, Callable  # Модуль для аннотаций типов (улучшает читаемость и проверку кода)
+from typing import List, Dict, Any, Callable, AsyncIterator, Tuple  # Модуль для аннотаций типов (улучшает читаемость и проверку кода)
 
 # --- Загрузка и Настройка ---
 
@@ -20,53 +35,254 @@ if not OPENAI_API_KEY:
 GREEN = '\033[92m'   # Зеленый (для ответов ассистента)
 YELLOW = '\033[93m'  # Желтый (для ввода пользователя)
 GRAY = '\033[90m'    # Серый (для сообщений о вызове функций)
+RED = '\033[91m'     # Красный (для сообщений об ошибках)
 RESET = '\033[0m'    # Сброс цвета
 
+# Вывод сообщений о вызовах функций (отключается переменной окружения DEBUG=0)
+DEBUG = os.getenv("DEBUG", "1") != "0"
+# Шаблон сообщения о вызове функции с заранее подставленными цветовыми кодами
+LOG_TEMPLATE = f"{GRAY}[Вызов функции] {{}}{RESET}\n"
+# Сообщение о запросе отчета не зависит от аргументов и формируется один раз
+INVENTORY_REPORT_LOG = LOG_TEMPLATE.format("Получение отчета по складу")
+
 # Максимальное количество сообщений в истории диалога (не считая системного сообщения)
 MAX_HISTORY = 10
 
+# Время (в секундах) ожидания дополнительных строк ввода, чтобы объединить быстро
+# введенные подряд команды в один запрос к модели
+INPUT_BATCH_WINDOW = 0.3
+
+# Файл журнала операций со складом (для восстановления склада после перезапуска)
+JOURNAL_PATH = os.getenv("WAREHOUSE_JOURNAL", "warehouse.log")
+
+# Модель OpenAI, используемая для диалога
+MODEL = "gpt-4o-mini"
+
+# Стабильный ключ кэширования промпта на стороне сервера: запросы с одинаковым
+# префиксом (системное сообщение + инструменты) попадают на одни и те же закэшированные блоки
+PROMPT_CACHE_KEY = "warehouse-agent-v1"
+
+# Лимиты API OpenAI, которые клиент не должен превышать (запросы и токены в минуту),
+# и максимальное число одновременных запросов
+MAX_REQUESTS_PER_MINUTE = 500
+MAX_TOKENS_PER_MINUTE = 200_000
+MAX_CONCURRENT_REQUESTS = 10
+
+# Максимальное количество ответов ассистента в локальном кэше
+RESPONSE_CACHE_MAXSIZE = 256
+# Сколько предыдущих реплик (пользователя и ассистента) входит в ключ кэша как контекст
+RESPONSE_CACHE_CONTEXT = 2
+
+# Системная инструкция (промпт) для модели. Создается один раз и никогда не изменяется:
+# побайтово одинаковый префикс запроса позволяет серверу переиспользовать кэш промпта.
+SYSTEM_MESSAGE: Dict[str, str] = {"role": "system", "content": (
+    "Ты — полезный ассистент для управления складом. Ты говоришь по-русски. "
+    "Используй доступные функции (add_item, remove_item, get_inventory) для управления инвентарем на основе запросов пользователя. "
+    "Если пользователь просит добавить или убрать товары, вызови соответствующую функцию. "
+    "Если пользователь спрашивает о текущих запасах или запрашивает отчет, используй функцию get_inventory. "
+    "Подтверждай выполненные действия или предоставляй запрошенную информацию о складе. "
+    "Если ты не можешь выполнить запрос с помощью функций, объясни почему. "
+    "Если вызов функции возвращает статус ошибки, сообщи пользователю об ошибке."
+)}
+
 # --- Инициализация Клиента OpenAI ---
-# Создание клиента для взаимодействия с API OpenAI
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+# Асинхронный клиент для взаимодействия с API OpenAI.
+# Создается в main() внутри event loop поверх постоянной сессии aiohttp (см. main).
+client: AsyncOpenAI
+# Постоянная сессия aiohttp, также используемая для прямых запросов к API (см. _request_tool_choice)
+http_session: aiohttp.ClientSession
 
 # --- Хранилище Данных (In-memory) ---
-# Словарь для хранения данных о товарах на складе (имя_товара: количество)
-inventory: Dict[str, int] = {}
+
+class Inventory:
+    """
+    Склад в виде "структуры массивов": названия товаров хранятся в списке, а количества —
+    в непрерывном массиве 64-битных целых, что ускоряет построение отчета по большому складу.
+    Доступ по названию товара как у словаря; для отсутствующего товара возвращается 0.
+    """
+
+    def __init__(self) -> None:
+        self.names: List[str] = []               # Названия товаров
+        self.quantities: array = array("q")      # Количества (индекс совпадает с names)
+        self.index: Dict[str, int] = {}          # Позиция товара по его названию
+        self._in_stock = 0                       # Число товаров с ненулевым количеством
+
+    def __getitem__(self, item_name: str) -> int:
+        i = self.index.get(item_name)
+        return 0 if i is None else self.quantities[i]
+
+    def __setitem__(self, item_name: str, quantity: int) -> None:
+        i = self.index.get(item_name)
+        if i is None:
+            # Новый товар добавляется в конец обоих массивов. Количество записывается первым:
+            # если оно не помещается в массив, названия и позиции остаются согласованными.
+            self.quantities.append(quantity)
+            self.index[item_name] = len(self.names)
+            self.names.append(item_name)
+            self._in_stock += quantity != 0
+            return
+        previous = self.quantities[i]
+        self.quantities[i] = quantity
+        self._in_stock += (quantity != 0) - (previous != 0)
+
+    def __delitem__(self, item_name: str) -> None:
+        # Позиция товара сохраняется (количество обнуляется), чтобы не сдвигать массивы
+        self[item_name] = 0
+
+    def __bool__(self) -> bool:
+        return self._in_stock > 0
+
+    def to_dict(self) -> Dict[str, int]:
+        """Возвращает товары в наличии в виде словаря (имя_товара: количество)."""
+        return {name: quantity for name, quantity in zip(self.names, self.quantities) if quantity}
+
+
+# Хранилище данных о товарах на складе (имя_товара: количество)
+inventory = Inventory()
+# Максимальное количество одного товара (предел 64-битного массива количеств)
+MAX_ITEM_QUANTITY = 2**63 - 1
+# Версия склада: увеличивается при каждом изменении, чтобы кэш ответов не возвращал устаревшие данные
+inventory_version = 0
+
+# --- Журнал Операций ---
+# Каждое успешное изменение склада дописывается в журнал в виде строки JSON.
+# Запись выполняет фоновая задача, чтобы не блокировать event loop; при запуске
+# журнал воспроизводится, и склад восстанавливается.
+
+# Очередь записей, ожидающих сохранения в журнал
+journal_queue: "asyncio.Queue[bytes]" = asyncio.Queue()
+
+def _journal(op: str, item_name: str, quantity: int) -> None:
+    """Ставит запись об изменении склада в очередь на запись в журнал."""
+    journal_queue.put_nowait(
+        orjson.dumps({"ts": time.time(), "op": op, "name": item_name, "qty": quantity}) + b"\n"
+    )
+
+def _write_journal_batch(journal_file: Any, data: bytes) -> None:
+    """
+    Записывает пакет записей в журнал одним вызовом и сбрасывает его на диск
+    (выполняется в отдельном потоке).
+    """
+    journal_file.write(data)
+    journal_file.flush()
+    os.fsync(journal_file.fileno())
+
+async def journal_writer(journal_file: Any) -> None:
+    """
+    Фоновая задача записи журнала. Все записи, накопившиеся к моменту пробуждения
+    (например, от параллельных вызовов функций), объединяются в одну операцию записи.
+    """
+    while True:
+        batch = [await journal_queue.get()]
+        while not journal_queue.empty():
+            batch.append(journal_queue.get_nowait())
+        await asyncio.to_thread(_write_journal_batch, journal_file, b"".join(batch))
+        for _ in batch:
+            journal_queue.task_done()
+
+async def flush_journal(writer_task: "asyncio.Task[None]") -> None:
+    """
+    Дожидается записи всех операций в журнал и останавливает задачу записи.
+    Если задача записи завершилась с ошибкой, ожидание не зависает, а ошибка выводится.
+    """
+    queue_drained = asyncio.create_task(journal_queue.join())
+    await asyncio.wait([queue_drained, writer_task], return_when=asyncio.FIRST_COMPLETED)
+    queue_drained.cancel()
+    writer_task.cancel()
+    if writer_task.done() and not writer_task.cancelled() and writer_task.exception():
+        print(f"{RED}Ошибка записи журнала склада: {writer_task.exception()}{RESET}")
+
+def replay_journal() -> None:
+    """Восстанавливает состояние склада, воспроизводя журнал операций."""
+    if not os.path.exists(JOURNAL_PATH) or os.path.getsize(JOURNAL_PATH) == 0:
+        return
+    with open(JOURNAL_PATH, "rb") as journal_file, \
+            mmap.mmap(journal_file.fileno(), 0, access=mmap.ACCESS_READ) as journal:
+        size = len(journal)
+        # Конец последней полной записи: все после него — недописанный фрагмент.
+        # Воспроизводятся только полные записи — фрагмент будет отрезан от файла,
+        # и склад в памяти должен совпадать с тем, что останется в журнале.
+        complete_size = journal.rfind(b"\n") + 1
+        while journal.tell() < complete_size:
+            line = journal.readline()
+            try:
+                event = orjson.loads(line)
+                if event["op"] == "add":
+                    inventory[event["name"]] += event["qty"]
+                elif event["op"] == "remove":
+                    inventory[event["name"]] -= event["qty"]
+            except (orjson.JSONDecodeError, KeyError, TypeError, OverflowError):
+                # Поврежденная запись или запись неожиданного вида пропускается
+                continue
+    # Отрезаем недописанный фрагмент, иначе следующая запись приклеится к нему и потеряется
+    if complete_size != size:
+        os.truncate(JOURNAL_PATH, complete_size)
+
+# --- Предвычисленные JSON-ответы ---
+# Ответы, которые не зависят от аргументов, сериализуются один раз при загрузке модуля.
+# Функции склада возвращают JSON в байтах; в строку он декодируется один раз в _execute_tool_call.
+EMPTY_INVENTORY_JSON = orjson.dumps({"status": "success", "inventory": "Склад пуст."})
+BAD_JSON_ARGS = orjson.dumps({"status": "error", "message": "Неверный формат JSON аргументов."})
+ERROR_BAD_QTY = orjson.dumps({"status": "error", "message": "Количество товара должно быть положительным целым числом."})
 
 # --- Функции Управления Складом ---
 # Эти функции будут вызываться моделью OpenAI для взаимодействия со складом
 
-def add_item(item_name: str, quantity: int) -> str:
-    """Добавляет товар и его количество на склад."""
-    print(f"{GRAY}[Вызов функции] Добавление {quantity} шт. товара '{item_name}'{RESET}")
-    inventory[item_name] = inventory.get(item_name, 0) + quantity
-    # Возвращает JSON-строку с результатом операции
-    return json.dumps({"status": "success", "message": f"Добавлено {quantity} шт. товара '{item_name}'."}, ensure_ascii=False)
+def _is_valid_quantity(quantity: Any) -> bool:
+    """Проверяет, что количество — целое число в допустимом диапазоне (bool не считается числом)."""
+    return type(quantity) is int and 0 < quantity <= MAX_ITEM_QUANTITY
 
-def remove_item(item_name: str, quantity: int) -> str:
+def add_item(item_name: str, quantity: int) -> bytes:
+    """Добавляет товар и его количество на склад."""
+    global inventory_version
+    if DEBUG:
+        sys.stdout.write(LOG_TEMPLATE.format(f"Добавление {quantity} шт. товара '{item_name}'"))
+    # Отсечение некорректного количества до изменения склада
+    if not _is_valid_quantity(quantity):
+        return ERROR_BAD_QTY
+    current = inventory[item_name]
+    if current + quantity > MAX_ITEM_QUANTITY:
+        return orjson.dumps({"status": "error", "message": f"Слишком большое количество товара '{item_name}'. В наличии: {current}."})
+    inventory[item_name] = current + quantity
+    inventory_version += 1
+    _journal("add", item_name, quantity)
+    # Возвращает JSON (в байтах UTF-8) с результатом операции
+    return orjson.dumps({"status": "success", "message": f"Добавлено {quantity} шт. товара '{item_name}'."})
+
+def remove_item(item_name: str, quantity: int) -> bytes:
     """Удаляет товар со склада в указанном количестве."""
-    print(f"{GRAY}[Вызов функции] Удаление {quantity} шт. товара '{item_name}'{RESET}")
-    # Проверка наличия товара
-    if item_name not in inventory:
-        return json.dumps({"status": "error", "message": f"Товар '{item_name}' не найден."}, ensure_ascii=False)
-    # Проверка достаточного количества
-    if inventory[item_name] < quantity:
-        return json.dumps({"status": "error", "message": f"Недостаточное количество товара '{item_name}'. В наличии: {inventory[item_name]}."}, ensure_ascii=False)
-
-    inventory[item_name] -= quantity
-    # Удаление товара из словаря, если количество стало нулевым
-    if inventory[item_name] == 0:
+    global inventory_version
+    if DEBUG:
+        sys.stdout.write(LOG_TEMPLATE.format(f"Удаление {quantity} шт. товара '{item_name}'"))
+    # Отсечение некорректного количества до обращения к складу
+    if not _is_valid_quantity(quantity):
+        return ERROR_BAD_QTY
+    # Единая проверка наличия и достаточного количества (отсутствующий товар — это 0)
+    current = inventory[item_name]
+    if current < quantity:
+        if not current:
+            return orjson.dumps({"status": "error", "message": f"Товар '{item_name}' не найден."})
+        return orjson.dumps({"status": "error", "message": f"Недостаточное количество товара '{item_name}'. В наличии: {current}."})
+
+    remaining = current - quantity
+    if remaining:
+        inventory[item_name] = remaining
+    else:
+        # Удаление товара со склада, если количество стало нулевым
         del inventory[item_name]
-    # Возвращает JSON-строку с результатом операции
-    return json.dumps({"status": "success", "message": f"Удалено {quantity} шт. товара '{item_name}'."}, ensure_ascii=False)
+    inventory_version += 1
+    _journal("remove", item_name, quantity)
+    # Возвращает JSON (в байтах UTF-8) с результатом операции
+    return orjson.dumps({"status": "success", "message": f"Удалено {quantity} шт. товара '{item_name}'."})
 
-def get_inventory() -> str:
+def get_inventory() -> bytes:
     """Возвращает отчет о текущем состоянии склада."""
-    print(f"{GRAY}[Вызов функции] Получение отчета по складу{RESET}")
+    if DEBUG:
+        sys.stdout.write(INVENTORY_REPORT_LOG)
     if not inventory:
-        return json.dumps({"status": "success", "inventory": "Склад пуст."}, ensure_ascii=False)
-    # Возвращает JSON-строку с содержимым склада
-    return json.dumps({"status": "success", "inventory": inventory}, ensure_ascii=False)
+        return EMPTY_INVENTORY_JSON
+    # Возвращает JSON (в байтах UTF-8) с содержимым склада
+    return orjson.dumps({"status": "success", "inventory": inventory.to_dict()})
 
 # --- Описание Инструментов (Функций) для OpenAI ---
 # Структура данных, описывающая доступные модели функции, их параметры и назначение.
@@ -114,76 +330,359 @@ tools = [
 
 # Словарь для сопоставления имен функций (строк) с реальными объектами функций Python.
 # Используется для вызова нужной функции по имени, полученному от API.
-available_functions: Dict[str, Callable[..., str]] = {
+available_functions: Dict[str, Callable[..., bytes]] = {
     "add_item": add_item,
     "remove_item": remove_item,
     "get_inventory": get_inventory,
 }
 
+# Описание инструментов неизменно, поэтому сериализуется один раз при загрузке модуля
+TOOLS_JSON = orjson.dumps(tools)
+
+# Начало тела запроса с выбором инструментов, заранее сериализованное в байты:
+# модель, описание функций, ключ кэша промпта и системное сообщение не меняются,
+# поэтому при каждом запросе дописываются только сообщения диалога.
+TOOL_REQUEST_PREFIX = b"".join([
+    b'{"model":', orjson.dumps(MODEL),                            # Модель OpenAI
+    b',"tool_choice":"auto"',                                     # Модель сама решает, вызывать ли функцию
+    b',"prompt_cache_key":', orjson.dumps(PROMPT_CACHE_KEY),      # Закрепление кэша промпта на сервере
+    b',"tools":', TOOLS_JSON,                                     # Передача описания функций
+    b',"messages":[', orjson.dumps(SYSTEM_MESSAGE),
+])
+
+# Неизменные параметры финального запроса к модели, собранные один раз (а не при каждом вызове)
+FINAL_REQUEST_PARAMS: Dict[str, Any] = {
+    "model": MODEL,                                        # Можно использовать ту же модель или другую
+    "stream": True,                                        # Получение ответа по частям
+    "extra_body": {"prompt_cache_key": PROMPT_CACHE_KEY},
+}
+
+# --- Кэш Ответов Ассистента ---
+# LRU-кэш: ключ — (версия склада, предыдущие реплики, текст запроса пользователя),
+# значение — финальный ответ. Модель и описание инструментов неизменны в пределах запуска,
+# поэтому в ключ не входят.
+CacheKey = Tuple[int, Tuple[Tuple[str, str], ...], str]
+response_cache: "OrderedDict[CacheKey, str]" = OrderedDict()
+
+def _dump_sdk_object(obj: Any) -> Any:
+    """Преобразует сообщения модели (объекты SDK) в словари для сериализации orjson."""
+    # Пустые поля не передаются, как и при сериализации запроса самим SDK
+    return obj.model_dump(exclude_none=True)
+
+def _cache_key(messages: List[Any]) -> CacheKey:
+    """
+    Вычисляет ключ кэша по последнему сообщению пользователя, версии склада и
+    RESPONSE_CACHE_CONTEXT предыдущим репликам (роль и текст), от которых зависят
+    ответы вроде "почему?" или "а груш?". Запросы на вызов функций и их результаты
+    в ключ не входят: их идентификаторы уникальны для каждого хода, и повторный вопрос
+    никогда не попал бы в кэш, а состояние склада уже учтено версией.
+    """
+    context: List[Tuple[str, str]] = []
+    for message in reversed(messages[1:-1]):
+        if len(context) == RESPONSE_CACHE_CONTEXT:
+            break
+        # Реплики пользователя и ассистента — словари; объекты SDK — это запросы на вызов функций
+        if isinstance(message, dict) and message["role"] in ("user", "assistant"):
+            context.append((message["role"], message["content"]))
+    return inventory_version, tuple(context), " ".join(messages[-1]["content"].split()).casefold()
+
+def _cache_get(key: CacheKey) -> str | None:
+    """Возвращает ответ из кэша (или None) и отмечает его как недавно использованный."""
+    cached = response_cache.get(key)
+    if cached is not None:
+        response_cache.move_to_end(key)
+    return cached
+
+def _cache_put(key: CacheKey, value: str) -> None:
+    """Сохраняет ответ в кэш, вытесняя самый давно использованный при переполнении."""
+    response_cache[key] = value
+    response_cache.move_to_end(key)
+    if len(response_cache) > RESPONSE_CACHE_MAXSIZE:
+        response_cache.popitem(last=False)
+
+# --- Ограничение Частоты Запросов ---
+
+class RateLimiter:
+    """
+    Ограничитель запросов к API по схеме "корзина токенов": емкость по запросам и по токенам
+    пополняется пропорционально прошедшему времени, а запрос ждет, пока емкости хватит.
+    Это удерживает нагрузку чуть ниже лимитов API и избегает ошибок 429 с долгими повторами.
+    """
+
+    def __init__(self, max_requests_per_minute: float, max_tokens_per_minute: float, max_concurrent: int) -> None:
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = max_requests_per_minute
+        self.available_token_capacity = max_tokens_per_minute
+        self._last_update = time.monotonic()
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    def _refill(self) -> None:
+        """Пополняет емкость пропорционально времени, прошедшему с прошлого обновления."""
+        now = time.monotonic()
+        elapsed = now - self._last_update
+        self._last_update = now
+        self.available_request_capacity = min(
+            self.available_request_capacity + self.max_requests_per_minute * elapsed / 60,
+            self.max_requests_per_minute,
+        )
+        self.available_token_capacity = min(
+            self.available_token_capacity + self.max_tokens_per_minute * elapsed / 60,
+            self.max_tokens_per_minute,
+        )
+
+    @asynccontextmanager
+    async def limit(self, estimated_tokens: int) -> AsyncIterator[None]:
+        """Ждет свободной емкости для запроса с оценочной стоимостью estimated_tokens."""
+        # Запрос дороже всей емкости никогда бы не дождался своей очереди
+        estimated_tokens = min(estimated_tokens, self.max_tokens_per_minute)
+        async with self._semaphore:
+            while True:
+                self._refill()
+                if self.available_request_capacity >= 1 and self.available_token_capacity >= estimated_tokens:
+                    self.available_request_capacity -= 1
+                    self.available_token_capacity -= estimated_tokens
+                    break
+                # Ожидание ровно до момента, когда недостающая емкость восполнится
+                missing_requests = max(1 - self.available_request_capacity, 0)
+                missing_tokens = max(estimated_tokens - self.available_token_capacity, 0)
+                await asyncio.sleep(max(
+                    missing_requests * 60 / self.max_requests_per_minute,
+                    missing_tokens * 60 / self.max_tokens_per_minute,
+                ))
+            yield
+
+def _estimate_tokens(messages: List[Any]) -> int:
+    """Грубая оценка числа токенов запроса: примерно 4 байта JSON на токен."""
+    return len(orjson.dumps(messages, default=_dump_sdk_object)) // 4
+
+# Общий ограничитель для всех обращений к модели
+rate_limiter = RateLimiter(MAX_REQUESTS_PER_MINUTE, MAX_TOKENS_PER_MINUTE, MAX_CONCURRENT_REQUESTS)
+
 # --- Логика Ведения Диалога ---
 
-def _execute_tool_call(tool_call: Any, messages: List[Dict[str, Any]]) -> None:
+# Функции, изменяющие склад: их успешный результат подтверждается без повторного запроса к модели
+MUTATING_FUNCTIONS = frozenset({"add_item", "remove_item"})
+
+def _confirm_mutations(tool_messages: List[Dict[str, Any]]) -> str | None:
+    """
+    Формирует подтверждение для пользователя без обращения к модели,
+    если все вызовы были успешными изменениями склада (add_item/remove_item).
+    Возвращает None, если нужен финальный ответ модели (ошибка или get_inventory).
+    """
+    confirmations = []
+    for tool_message in tool_messages:
+        if tool_message["name"] not in MUTATING_FUNCTIONS:
+            return None
+        result = orjson.loads(tool_message["content"])
+        if result.get("status") != "success":
+            return None
+        confirmations.append(result["message"])
+    return "\n".join(confirmations)
+
+async def _execute_tool_call(tool_call: Any) -> Dict[str, Any]:
     """
     Выполняет один вызов функции, запрошенный моделью.
-    Определяет функцию, парсит аргументы, вызывает функцию и добавляет результат (или ошибку)
-    обратно в историю сообщений (`messages`) с ролью 'tool'.
+    Определяет функцию, парсит аргументы, вызывает функцию и возвращает результат (или ошибку)
+    в виде сообщения с ролью 'tool' для добавления в историю.
     """
     function_name = tool_call.function.name
     function_to_call = available_functions.get(function_name)
-    # Подготовка сообщения с результатом вызова инструмента
-    tool_message = {
-        "tool_call_id": tool_call.id, # ID для связи с запросом модели
-        "role": "tool",
-        "name": function_name,
-    }
 
     # Обработка случая, если функция не найдена
     if not function_to_call:
-        tool_message["content"] = json.dumps(
-            {"status": "error", "message": f"Функция '{function_name}' не найдена."}, ensure_ascii=False
+        content = orjson.dumps(
+            {"status": "error", "message": f"Функция '{function_name}' не найдена."}
         )
     else:
         # Попытка выполнить функцию
         try:
             # Аргументы от модели приходят в виде JSON-строки
-            function_args = json.loads(tool_call.function.arguments)
+            function_args = orjson.loads(tool_call.function.arguments)
             # Вызов реальной функции Python с аргументами
-            function_response = function_to_call(**function_args)
-            tool_message["content"] = function_response
-        except json.JSONDecodeError:
+            content = function_to_call(**function_args)
+        except orjson.JSONDecodeError:
             # Ошибка парсинга JSON-аргументов
-            tool_message["content"] = json.dumps(
-                {"status": "error", "message": "Неверный формат JSON аргументов."}, ensure_ascii=False
-            )
+            content = BAD_JSON_ARGS
         except TypeError as e:
             # Ошибка несоответствия аргументов функции
-            tool_message["content"] = json.dumps(
-                {"status": "error", "message": f"Неверные аргументы для функции {function_name}: {str(e)}"}, ensure_ascii=False
+            content = orjson.dumps(
+                {"status": "error", "message": f"Неверные аргументы для функции {function_name}: {str(e)}"}
             )
         except Exception as e:
             # Любая другая ошибка при выполнении функции
-            tool_message["content"] = json.dumps(
-                {"status": "error", "message": f"Ошибка при выполнении функции {function_name}: {str(e)}"}, ensure_ascii=False
+            content = orjson.dumps(
+                {"status": "error", "message": f"Ошибка при выполнении функции {function_name}: {str(e)}"}
             )
 
-    # Добавление результата вызова (или ошибки) в историю сообщений
-    messages.append(tool_message)
+    # Сообщение с результатом вызова (или ошибкой) для добавления в историю сообщений.
+    # Собирается одним литералом со всеми ключами, без последующего изменения словаря.
+    return {
+        "tool_call_id": tool_call.id, # ID для связи с запросом модели
+        "role": "tool",
+        "name": function_name,
+        # API принимает содержимое сообщения только строкой — декодируем один раз здесь
+        "content": content.decode(),
+    }
+
+
+def _print_assistant(text: str) -> str:
+    """Выводит ответ ассистента целиком и возвращает его для добавления в историю."""
+    print(f"{GREEN}Ассистент: {text}{RESET}")
+    return text
+
+async def _stream_final_response(messages: List[Any]) -> str:
+    """
+    Запрашивает финальный ответ модели в потоковом режиме, выводя токены по мере получения.
+    Возвращает полный текст ответа для добавления в историю.
+    """
+    async with rate_limiter.limit(_estimate_tokens(messages)):
+        stream = await client.chat.completions.create(messages=messages, **FINAL_REQUEST_PARAMS)
+    parts: List[str] = []
+    print(f"{GREEN}Ассистент: ", end="", flush=True)
+    try:
+        async for chunk in stream:
+            # Служебные фрагменты потока могут не содержать вариантов ответа
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                print(content, end="", flush=True)
+                parts.append(content)
+    finally:
+        # Сброс цвета и перевод строки даже при обрыве потока, чтобы сообщение
+        # об ошибке не попало на ту же строку после частичного ответа
+        print(RESET)
+    return "".join(parts)
+
+
+# --- Быстрая Обработка Простых Команд ---
+# Однозначные команды вида "Покажи склад" выполняются напрямую, без обращения к модели.
+# Добавление и удаление выполняются напрямую, только если названный товар уже есть на складе:
+# слово из команды стоит в падеже ("5 яблок"), а модель приводит названия к единой форме,
+# поэтому новые товары заводит модель, иначе на складе появятся дубли.
+# Все остальные запросы передаются модели.
+ADD_COMMAND_RE = re.compile(r"^(?:добавь|прибавь)\s+(\d+)\s+(\S+?)[.!]?$", re.IGNORECASE)
+REMOVE_COMMAND_RE = re.compile(r"^(?:убери|удали)\s+(\d+)\s+(\S+?)[.!]?$", re.IGNORECASE)
+REPORT_COMMAND_RE = re.compile(r"^(?:покажи\s+склад|отчет|отчёт)[.!]?$", re.IGNORECASE)
+
+def _format_inventory_report(result: Dict[str, Any]) -> str:
+    """Формирует текстовый отчет по складу из результата get_inventory."""
+    report = result["inventory"]
+    if isinstance(report, str): # Склад пуст
+        return report
+    return "Товары на складе:\n" + "\n".join(f"- {name}: {quantity} шт." for name, quantity in report.items())
+
+def _try_fast_path(user_input: str) -> str | None:
+    """
+    Выполняет простую команду напрямую, без обращения к модели.
+    Возвращает текст ответа или None, если команда не распознана и нужна модель.
+    """
+    text = user_input.strip()
+    if REPORT_COMMAND_RE.match(text):
+        return _format_inventory_report(orjson.loads(get_inventory()))
+    if match := ADD_COMMAND_RE.match(text):
+        function_to_call = add_item
+    elif match := REMOVE_COMMAND_RE.match(text):
+        function_to_call = remove_item
+    else:
+        return None
+    # Товара с таким названием нет на складе — форму названия определит модель
+    if not inventory[match[2]]:
+        return None
+    return orjson.loads(function_to_call(match[2], int(match[1])))["message"]
+
 
+def _build_tool_request_body(messages: List[Any]) -> bytes:
+    """
+    Собирает тело запроса с выбором инструментов из заранее сериализованного префикса
+    и сообщений диалога. Первое сообщение — всегда SYSTEM_MESSAGE, оно уже входит в префикс.
+    """
+    parts = [TOOL_REQUEST_PREFIX]
+    for i in range(1, len(messages)):
+        parts.append(b",")
+        parts.append(orjson.dumps(messages[i], default=_dump_sdk_object))
+    parts.append(b"]}")
+    return b"".join(parts)
+
+# Таймауты прямого запроса (как по умолчанию в SDK: 10 минут на запрос, 5 секунд на соединение)
+TOOL_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=600, connect=5)
+# Коды ответа, при которых запрос повторяется (как в SDK); также повторяются все ошибки 5xx
+RETRYABLE_STATUSES = frozenset({408, 409, 429})
+# Максимальная пауза между повторами, которую принимаем из заголовка Retry-After (секунды)
+MAX_RETRY_AFTER = 60
+
+def _retry_delay(attempt: int, retry_after: str | None) -> float:
+    """Пауза перед повтором: из заголовка Retry-After или экспоненциальная со случайной составляющей."""
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            pass
+        else:
+            if 0 <= delay <= MAX_RETRY_AFTER:
+                return delay
+    return min(0.5 * 2 ** attempt, 8.0) * (1 - 0.25 * random.random())
 
-def run_conversation(messages: List[Dict[str, Any]]) -> str | None:
+def _tool_request_headers() -> Dict[str, str]:
+    """
+    Заголовки прямого запроса: те же, что отправляет SDK (авторизация, организация,
+    проект, User-Agent), без пропущенных значений.
+    """
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    headers.update((name, value) for name, value in client.default_headers.items() if isinstance(value, str))
+    return headers
+
+async def _request_tool_choice(messages: List[Any]) -> ChatCompletion:
+    """
+    Отправляет запрос с выбором инструментов напрямую через сессию aiohttp, минуя
+    сериализацию SDK, и возвращает ответ в виде модели SDK.
+    Как и SDK, повторяет запрос (до client.max_retries раз) при ошибках соединения,
+    превышении лимитов (429) и ошибках сервера (5xx), соблюдая заголовок Retry-After.
+    """
+    body = _build_tool_request_body(messages)
+    url = f"{client.base_url}chat/completions"
+    headers = _tool_request_headers()
+    for attempt in range(client.max_retries + 1):
+        is_last_attempt = attempt == client.max_retries
+        retry_after = None
+        try:
+            async with rate_limiter.limit(len(body) // 4):
+                async with http_session.post(url, data=body, headers=headers, timeout=TOOL_REQUEST_TIMEOUT) as response:
+                    raw = await response.read()
+                    if response.status < 400:
+                        return ChatCompletion.model_construct(**orjson.loads(raw))
+                    retryable = response.status in RETRYABLE_STATUSES or response.status >= 500
+                    if is_last_attempt or not retryable:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history,
+                            status=response.status, message=raw.decode(errors="replace"),
+                        )
+                    retry_after = response.headers.get("Retry-After")
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if is_last_attempt:
+                raise
+        await asyncio.sleep(_retry_delay(attempt, retry_after))
+    # Недостижимо: последняя попытка либо возвращает ответ, либо выбрасывает исключение
+    raise AssertionError("unreachable")
+
+
+async def run_conversation(messages: List[Dict[str, Any]]) -> str | None:
     """
     Основная функция для ведения диалога с моделью OpenAI.
     Отправляет историю сообщений модели, обрабатывает потенциальные вызовы функций,
-    выполняет их и возвращает итоговый ответ модели пользователю.
+    выполняет их, выводит итоговый ответ модели пользователю и возвращает его.
     """
+    # Шаг 0: Проверка кэша — тот же запрос при неизменном складе дает тот же ответ
+    cache_key = _cache_key(messages)
+    cached_response = _cache_get(cache_key)
+    if cached_response is not None:
+        return _print_assistant(cached_response)
+    version_before = inventory_version
+
     try:
         # Шаг 1: Отправка запроса модели с историей и доступными инструментами
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", # Модель OpenAI (можно сделать параметром)
-            messages=messages,
-            tools=tools,          # Передача описания функций
-            tool_choice="auto",   # Модель сама решает, вызывать ли функцию
-        )
+        response = await _request_tool_choice(messages)
         response_message = response.choices[0].message
         tool_calls = response_message.tool_calls # Проверка, запросила ли модель вызов функции
 
@@ -191,96 +690,248 @@ def run_conversation(messages: List[Dict[str, Any]]) -> str | None:
         if tool_calls:
             # Добавляем ответ модели (с запросом на вызов) в историю
             messages.append(response_message)
-            # Шаг 3: Выполнение каждой запрошенной функции
-            for tool_call in tool_calls:
-                _execute_tool_call(tool_call, messages)
+            # Шаг 3: Конкурентное выполнение всех запрошенных функций.
+            # asyncio.gather возвращает результаты в порядке вызовов, что сохраняет
+            # соответствие tool_call_id ожидаемому API порядку.
+            tool_messages = await asyncio.gather(*[_execute_tool_call(tool_call) for tool_call in tool_calls])
+            messages.extend(tool_messages)
+
+            # Если все вызовы — успешные добавления/удаления, подтверждаем их сразу,
+            # без второго обращения к модели (результат уже известен).
+            confirmation = _confirm_mutations(tool_messages)
+            if confirmation is not None:
+                return _print_assistant(confirmation)
 
             # Шаг 4: Отправка второго запроса модели с результатами вызова функций
-            # Модель использует эти результаты для формулировки финального ответа.
-            second_response = client.chat.completions.create(
-                model="gpt-4o-mini", # Можно использовать ту же модель или другую
-                messages=messages,
-            )
-            # Возвращаем текстовый ответ модели
-            return second_response.choices[0].message.content
+            # Модель использует эти результаты для формулировки финального ответа,
+            # который выводится пользователю по мере генерации.
+            assistant_response = await _stream_final_response(messages)
         else:
-            # Если вызова функции не было, просто возвращаем текстовый ответ модели
-            return response_message.content
+            # Если вызова функции не было, просто выводим текстовый ответ модели
+            assistant_response = response_message.content
+            if assistant_response:
+                _print_assistant(assistant_response)
+
+        # Кэшируем только ответы, не изменившие склад: повтор изменяющей команды
+        # должен снова выполнить функции, а не вернуть сохраненное подтверждение.
+        if assistant_response and inventory_version == version_before:
+            _cache_put(cache_key, assistant_response)
+        # Возвращаем текстовый ответ модели
+        return assistant_response
 
     # Обработка различных ошибок API и других исключений
     except openai.APIError as e:
         print(f"{RED}Ошибка OpenAI API: {e}{RESET}")
-        return f"Извините, произошла ошибка при связи с моделью ИИ: {e}"
+        return _print_assistant(f"Извините, произошла ошибка при связи с моделью ИИ: {e}")
+    except aiohttp.ClientResponseError as e:
+        # Ошибка прямого запроса к API (см. _request_tool_choice)
+        if e.status == 401:
+            print(f"{RED}Ошибка аутентификации: Проверьте ваш OPENAI_API_KEY.{RESET}")
+            return _print_assistant("Ошибка аутентификации: Убедитесь, что ваш OPENAI_API_KEY установлен правильно.")
+        print(f"{RED}Ошибка OpenAI API: {e.status} {e.message}{RESET}")
+        return _print_assistant(f"Извините, произошла ошибка при связи с моделью ИИ: {e.status} {e.message}")
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+        # Не удалось соединиться с API после всех повторов (см. _request_tool_choice)
+        print(f"{RED}Ошибка соединения с OpenAI API: {e!r}{RESET}")
+        return _print_assistant("Извините, не удалось связаться с моделью ИИ. Попробуйте еще раз.")
     except openai.AuthenticationError:
         print(f"{RED}Ошибка аутентификации: Проверьте ваш OPENAI_API_KEY.{RESET}")
-        return "Ошибка аутентификации: Убедитесь, что ваш OPENAI_API_KEY установлен правильно."
+        return _print_assistant("Ошибка аутентификации: Убедитесь, что ваш OPENAI_API_KEY установлен правильно.")
     except Exception as e:
         print(f"{RED}Произошла непредвиденная ошибка: {e}{RESET}")
-        return "Извините, произошла непредвиденная ошибка."
+        return _print_assistant("Извините, произошла непредвиденная ошибка.")
     # Теоретически недостижимо при нормальной работе, но для полноты
     return None
 
 
 # --- Основной Блок Выполнения ---
 
-def main():
-    """Главная функция запуска агента склада."""
-    print("Агент Склада инициализирован.")
-    print("Примеры команд: 'Добавь 5 яблок', 'Убери 2 банана', 'Покажи склад', 'Сколько яблок на складе?'")
-    print("Введите 'выход' или 'exit' для завершения.")
+async def _read_input(prompt: str) -> str:
+    """
+    Считывает строку ввода в фоновом daemon-потоке, не блокируя event loop.
+    В отличие от asyncio.to_thread, такой поток не задерживает завершение программы:
+    по Ctrl+C процесс выходит сразу, не дожидаясь, пока пользователь нажмет Enter.
+    """
+    loop = asyncio.get_running_loop()
+    future: "asyncio.Future[str]" = loop.create_future()
+
+    def _deliver(result: str | None, error: BaseException | None) -> None:
+        # Ожидание могло быть уже отменено (например, по Ctrl+C)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _worker() -> None:
+        try:
+            line, error = input(prompt), None
+        except BaseException as e: # EOFError и прочие ошибки передаются в event loop
+            line, error = None, e
+        try:
+            loop.call_soon_threadsafe(_deliver, line, error)
+        except RuntimeError: # Event loop уже закрыт — программа завершается
+            pass
+
+    threading.Thread(target=_worker, daemon=True).start()
+    return await future
+
+def _is_exit_command(line: str) -> bool:
+    """Проверяет, является ли строка командой выхода."""
+    return line.strip().lower() in ('выход', 'exit')
+
+def _stdin_ready() -> bool:
+    """Ждет до INPUT_BATCH_WINDOW секунд, пока в стандартном вводе появятся данные."""
+    return bool(select.select([sys.stdin], [], [], INPUT_BATCH_WINDOW)[0])
 
-    # Инициализация истории сообщений с системной инструкцией (промптом)
-    messages: List[Dict[str, Any]] = [{"role": "system", "content": (
-        "Ты — полезный ассистент для управления складом. Ты говоришь по-русски. "
-        "Используй доступные функции (add_item, remove_item, get_inventory) для управления инвентарем на основе запросов пользователя. "
-        "Если пользователь просит добавить или убрать товары, вызови соответствующую функцию. "
-        "Если пользователь спрашивает о текущих запасах или запрашивает отчет, используй функцию get_inventory. "
-        "Подтверждай выполненные действия или предоставляй запрошенную информацию о складе. "
-        "Если ты не можешь выполнить запрос с помощью функций, объясни почему. "
-        "Если вызов функции возвращает статус ошибки, сообщи пользователю об ошибке."
-    )}]
+async def _read_pending_lines() -> Tuple[List[str], bool]:
+    """
+    Считывает строки, уже ожидающие в стандартном вводе (например, вставленные или
+    введенные подряд команды), чтобы отправить их модели одним сообщением.
+    Возвращает считанные строки и признак того, что среди них встретилась команда выхода
+    (строки после нее не считываются). Строки читаются тем же daemon-потоком, что и
+    основной ввод, поэтому недописанная строка не задерживает выход по Ctrl+C.
+    """
+    lines: List[str] = []
+    # select не поддерживает стандартный ввод в Windows — там команды обрабатываются по одной
+    if sys.platform == "win32":
+        return lines, False
+    while await asyncio.to_thread(_stdin_ready):
+        try:
+            line = await _read_input("")
+        except EOFError: # Конец ввода: выход произойдет при следующем чтении команды
+            break
+        if _is_exit_command(line):
+            return lines, True
+        lines.append(line)
+    return lines, False
+
+def _trim_history(history: "deque[Any]") -> None:
+    """
+    Удаляет сообщения из начала истории, пока она не начнется с сообщения пользователя.
+    deque вытесняет сообщения по одному и может убрать запрос на вызов функций, оставив
+    его результаты (сообщения 'tool'); API отклоняет такую историю с ошибкой 400.
+    """
+    while history and not (isinstance(history[0], dict) and history[0]["role"] == "user"):
+        history.popleft()
+
+async def chat_loop():
+    """Цикл диалога с пользователем: чтение команд, запрос к модели, ведение истории."""
+    # История диалога (user/assistant/tool) без системного сообщения.
+    # deque с maxlen автоматически вытесняет старые сообщения, сохраняя последние MAX_HISTORY,
+    # что предотвращает слишком большой контекст для API.
+    history: "deque[Any]" = deque(maxlen=MAX_HISTORY)
+
+    # Признак команды выхода, введенной вслед за другими командами:
+    # сначала обрабатываются команды перед ней, затем работа завершается
+    exit_requested = False
 
     # Основной цикл для взаимодействия с пользователем
     while True:
+        if exit_requested:
+            print("Завершение работы.")
+            break
         try:
-            # Получение ввода от пользователя
-            user_input = input(f"{YELLOW}Вы: {RESET}")
-        except EOFError: # Обработка Ctrl+D для выхода
+            # Получение ввода от пользователя (в отдельном потоке, чтобы не блокировать event loop)
+            user_input = await _read_input(f"{YELLOW}Вы: {RESET}")
+
+            # Проверка команды выхода
+            if _is_exit_command(user_input):
+                print("Завершение работы.")
+                break
+
+            # Объединение быстро введенных подряд команд в одно сообщение:
+            # модель вернет все вызовы функций одним ответом, и они выполнятся параллельно
+            pending_lines, exit_requested = await _read_pending_lines()
+        except (EOFError, KeyboardInterrupt, asyncio.CancelledError): # Обработка Ctrl+D и Ctrl+C для выхода
              print("\nВыход.")
              break
 
-        # Проверка команды выхода
-        if user_input.lower() in ['выход', 'exit']:
-            print("Завершение работы.")
-            break
+        if pending_lines:
+            user_input = "\n".join([user_input, *pending_lines])
 
         # Добавление сообщения пользователя в историю
-        messages.append({"role": "user", "content": user_input})
+        history.append({"role": "user", "content": user_input})
 
-        # --- Управление размером истории ---
-        # Оставляем системное сообщение и последние MAX_HISTORY сообщений (user/assistant/tool)
-        # Это предотвращает слишком большой контекст для API
-        if len(messages) > MAX_HISTORY + 1: # +1 для системного сообщения
-             # Удаляем старые сообщения, сохраняя системное и последние MAX_HISTORY
-             messages = [messages[0]] + messages[-(MAX_HISTORY):]
-
-
-        # Получение ответа от ассистента (с возможным вызовом функций)
-        assistant_response = run_conversation(messages)
-
-        # Вывод ответа ассистента, если он получен
+        # Простые команды выполняются сразу, без обращения к модели;
+        # ответ все равно сохраняется в истории, чтобы контекст диалога оставался полным.
+        try:
+            fast_response = _try_fast_path(user_input)
+        except Exception: # При любой ошибке быстрой обработки команда передается модели
+            fast_response = None
+        if fast_response is not None:
+            history.append({"role": "assistant", "content": _print_assistant(fast_response)})
+            continue
+
+        # Сборка запроса: системное сообщение всегда первое и одним и тем же объектом.
+        # Добавление ответов ассистента и пользователя тоже вытесняет старые сообщения,
+        # поэтому начало истории выравнивается еще раз перед отправкой.
+        _trim_history(history)
+        messages: List[Any] = [SYSTEM_MESSAGE, *history]
+        sent_count = len(messages)
+
+        # Получение и вывод ответа от ассистента (с возможным вызовом функций)
+        assistant_response = await run_conversation(messages)
+        # Перенос в историю сообщений, добавленных во время диалога (запросы функций и их результаты)
+        history.extend(messages[sent_count:])
+        _trim_history(history)
+
+        # Ответ ассистента уже выведен в run_conversation
         if assistant_response:
-            print(f"{GREEN}Ассистент: {assistant_response}{RESET}")
             # Добавление ответа ассистента в историю
-            messages.append({"role": "assistant", "content": assistant_response})
+            history.append({"role": "assistant", "content": assistant_response})
         else:
             # Обработка случая, когда ответ не был получен (из-за ошибки)
             print(f"{RED}Ассистент: Не удалось получить ответ.{RESET}")
             # При необходимости можно удалить последнее сообщение пользователя,
             # чтобы избежать повторной отправки некорректного запроса.
-            # messages.pop()
+            # history.pop()
+
+
+async def main() -> int:
+    """Главная функция запуска агента склада. Возвращает код завершения процесса."""
+    global client, http_session
+    print("Агент Склада инициализирован.")
+    print("Примеры команд: 'Добавь 5 яблок', 'Убери 2 банана', 'Покажи склад', 'Сколько яблок на складе?'")
+    print("Введите 'выход' или 'exit' для завершения.")
+
+    # Восстановление склада из журнала и запуск фоновой записи новых операций.
+    # Журнал открывается до начала диалога, чтобы ошибка (неверный путь, нет прав)
+    # была видна сразу, а не терялась в фоновой задаче.
+    try:
+        replay_journal()
+        journal_file = open(JOURNAL_PATH, "ab")
+    except OSError as e:
+        print(f"{RED}Не удалось открыть журнал склада '{JOURNAL_PATH}': {e}{RESET}")
+        return 1
+    writer_task = asyncio.create_task(journal_writer(journal_file))
+
+    # Одна долгоживущая сессия aiohttp на все время работы: соединения с API переиспользуются
+    # (keep-alive), а DNS-ответы кэшируются, поэтому DNS-запрос и TLS-рукопожатие
+    # не повторяются при каждом обращении к модели.
+    connector = aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as http_session:
+            client = AsyncOpenAI(
+                api_key=OPENAI_API_KEY,
+                http_client=DefaultAioHttpClient(transport=AiohttpTransport(client=http_session)),
+            )
+            # Клиент закрывается при выходе из блока вместе с HTTP-соединениями
+            async with client:
+                await chat_loop()
+    finally:
+        # Дожидаемся записи всех операций в журнал перед завершением
+        await flush_journal(writer_task)
+        journal_file.close()
+    return 0
 
 
-# Точка входа в программу: если скрипт запущен напрямую, вызываем main()
+# Точка входа в программу: если скрипт запущен напрямую, запускаем main() в event loop
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    exit_code = asyncio.run(main())
+    # После выхода по Ctrl+C поток чтения ввода остается заблокированным в input().
+    # Все ресурсы уже закрыты в main(), поэтому процесс завершается сразу, не дожидаясь
+    # этого потока при финализации интерпретатора.
+    sys.stdout.flush()
+    os._exit(exit_code) 
\ No newline at end of file